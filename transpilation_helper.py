@@ -1,7 +1,19 @@
+import functools
 import os
 import re
-from typing import List
-import pyperclip as pc
+import sys
+from textwrap import dedent
+from types import ModuleType
+from typing import Callable, List
+
+# pyperclip is only needed for the interactive clipboard mode, so the conversion
+# functions (and `--stdin`) still work without it, ex. on a bare PyPy install
+pc: ModuleType | None
+try:
+    import pyperclip
+    pc = pyperclip
+except ImportError:
+    pc = None
 
 
 def split_not_in_brackets(
@@ -18,47 +30,89 @@ def split_not_in_brackets(
     Delimeter may be multiple characters. If `strip_elements` is True, the elements
     will be stripped of leading and trailing whitespace.
     """
+    return list(_split_not_in_brackets(s, sep, open_bracket, close_bracket, strip_elements))
+
+@functools.lru_cache(maxsize=4096)
+def _split_not_in_brackets(
+        s: str,
+        sep: str,
+        open_bracket: str,
+        close_bracket: str,
+        strip_elements: bool,
+    ) -> tuple[str, ...]:
+    """
+    Cached implementation of `split_not_in_brackets()`. Returns a tuple so the
+    cached result can't be modified by callers.
+
+    Rather than stepping through `s` one character at a time, this jumps between
+    occurrences of `sep` with `str.find()` and uses `str.count()` to get the bracket
+    level at each one, so the loop only runs once per candidate separator.
+    """
     result = []
     bracket_level = 0
     after_last_sep_idx = 0
-    current_idx = 0
-    while current_idx < len(s):
-        if s[current_idx] == open_bracket:
-            bracket_level += 1
-        elif s[current_idx] == close_bracket:
-            bracket_level -= 1
-        elif s[current_idx:].startswith(sep) and bracket_level == 0:
-            e = s[after_last_sep_idx:current_idx]
+    counted_up_to_idx = 0
+    sep_idx = s.find(sep)
+    while 0 <= sep_idx < len(s):
+        bracket_level += s.count(open_bracket, counted_up_to_idx, sep_idx)
+        bracket_level -= s.count(close_bracket, counted_up_to_idx, sep_idx)
+        counted_up_to_idx = sep_idx
+
+        # A bracket takes precedence over a separator starting at the same index
+        if bracket_level == 0 and s[sep_idx] not in (open_bracket, close_bracket):
+            e = s[after_last_sep_idx:sep_idx]
             if strip_elements:
                 e = e.strip()
             result.append(e)
-            after_last_sep_idx = current_idx + len(sep)
-        current_idx += 1
+            after_last_sep_idx = sep_idx + len(sep)
+        sep_idx = s.find(sep, sep_idx + 1)
     if after_last_sep_idx < len(s):
         e = s[after_last_sep_idx:]
         if strip_elements:
             e = e.strip()
         result.append(e)
-    return result
+    return tuple(result)
+
+def _find_default_sep(param: str) -> int:
+    """
+    Return the index of the `=` that separates a parameter from its default value, or -1
+    if there is none. An `=` inside brackets or quotes (ex. in `Literal["=="]`) is part
+    of the type, not a separator.
+    """
+    if '=' not in param:
+        return -1
+    bracket_level = 0
+    quote = ''
+    for i, c in enumerate(param):
+        if quote:
+            if c == quote:
+                quote = ''
+        elif c in '\'"':
+            quote = c
+        elif c == '[':
+            bracket_level += 1
+        elif c == ']':
+            bracket_level -= 1
+        elif c == '=' and bracket_level == 0:
+            return i
+    return -1
 
-def extract_name_type_default(param: str) -> tuple[str, str, str]:
+@functools.lru_cache(maxsize=4096)
+def extract_name_type_default(param: str) -> tuple[str, str | None, str | None]:
     """
     Given an item in a Python function/method's parameter list as a string,
     get the parameter name (converted from string_case to camelCase), type (if typed),
     and default value (if set).
     """
-    param = param.replace(': ', 'α').replace(' = ', 'β')
-    colon_idx = param.find('α')
-    equal_idx = param.find('β')
-    if colon_idx == equal_idx == -1:
-        pname, ptype, pdefault = param, None, None
-    elif colon_idx != -1 and equal_idx == -1:
-        pname, ptype, pdefault = param[:colon_idx], param[colon_idx+1:], None
-    elif colon_idx == -1 and equal_idx != -1:
-        pname, ptype, pdefault = param[:equal_idx], None, param[equal_idx+1:]
-    else:
-        pname, ptype, pdefault = param[:colon_idx], param[colon_idx+1:equal_idx], param[equal_idx+1:]
-
+    # Names can't contain `:` or `=`, so the first `:` before the default's `=` starts
+    # the type. Any amount of whitespace is allowed around both (ex. `x=3`, `y:int`).
+    equal_idx = _find_default_sep(param)
+    type_end_idx = equal_idx if equal_idx != -1 else len(param)
+    colon_idx = param.find(':', 0, type_end_idx)
+
+    pname = param[:colon_idx if colon_idx != -1 else type_end_idx].strip()
+    ptype = param[colon_idx+1: type_end_idx].strip() if colon_idx != -1 else None
+    pdefault = param[equal_idx+1:].strip() if equal_idx != -1 else None
     return pname, ptype, pdefault
 
 def get_matching_bracket_idx(s: str, opening_bracket_idx: int) -> int:
@@ -68,16 +122,19 @@ def get_matching_bracket_idx(s: str, opening_bracket_idx: int) -> int:
 
     Raises ValueError if no matching closing bracket is found.
     """
+    # Jump straight to the next bracket of either kind instead of checking every character
     bracket_level = 0
-    current_idx = opening_bracket_idx
-    while current_idx < len(s):
-        if s[current_idx] == '[':
+    open_idx = s.find('[', opening_bracket_idx)
+    close_idx = s.find(']', opening_bracket_idx)
+    while close_idx != -1:
+        if open_idx != -1 and open_idx < close_idx:
             bracket_level += 1
-        elif s[current_idx] == ']':
+            open_idx = s.find('[', open_idx + 1)
+        else:
             bracket_level -= 1
             if bracket_level == 0:
-                return current_idx
-        current_idx += 1
+                return close_idx
+            close_idx = s.find(']', close_idx + 1)
     raise ValueError(f'No matching bracket found in string: {s}')
 
 def get_first_brackets(s: str, *, assert_closes_at_end: bool = False) -> tuple[int, int]:
@@ -97,9 +154,40 @@ def get_first_brackets(s: str, *, assert_closes_at_end: bool = False) -> tuple[i
         raise ValueError(f'Closing bracket not at the end of the string: {s}')
     return b1, b2
 
+def get_line_indents(file_lines: List[str]) -> List[int]:
+    """
+    Return the number of leading spaces of each line in `file_lines`, or -1 for
+    empty and whitespace-only lines (which have no meaningful indent).
+    """
+    return [
+        -1 if not line or line.isspace() else len(line) - len(line.lstrip())
+        for line in file_lines
+    ]
+
+def _get_block_line_indents(block_opening_line_idx: int, file_lines: List[str]) -> List[int]:
+    """
+    Return `get_line_indents()` for the lines from the opening line of a block up to and
+    including the first non-blank line after it without a greater indent (or the end of
+    `file_lines`). These are the only lines `get_end_of_block_idx()` needs to look at.
+    """
+    block_indents = []
+    offset = -1
+    for idx in range(block_opening_line_idx, len(file_lines)):
+        line = file_lines[idx]
+        indent = -1 if not line or line.isspace() else len(line) - len(line.lstrip())
+        block_indents.append(indent)
+        if len(block_indents) == 1:
+            offset = indent
+            if offset == -1:
+                break
+        elif indent != -1 and indent <= offset:
+            break
+    return block_indents
+
 def get_end_of_block_idx(
         block_opening_line_idx: int,
         file_lines: List[str],
+        line_indents: List[int] | None = None,
     ) -> int:
     """
     Given the 0-indexed line index of the opening line of a block (e.g. if statement,
@@ -108,51 +196,43 @@ def get_end_of_block_idx(
 
     If the given idx does not open a block (the next non-empty, non-whitespace line has
     the same or lesser indent), returns the given index.
+
+    `line_indents` should be the result of `get_line_indents(file_lines)`. Callers that
+    look up many blocks in the same lines should compute it once and pass it in.
+    Otherwise only the indents of the lines in the block are computed.
     """
-    line = file_lines[block_opening_line_idx]
-    offset = len(line) - len(line.lstrip())  # Number of leading spaces
+    if line_indents is None:
+        block_indents = _get_block_line_indents(block_opening_line_idx, file_lines)
+        block_lines = file_lines[block_opening_line_idx: block_opening_line_idx + len(block_indents)]
+        return block_opening_line_idx + get_end_of_block_idx(0, block_lines, block_indents)
+
+    offset = line_indents[block_opening_line_idx]  # Number of leading spaces
 
     # Whitespace and blank lines cannot open a block
-    if not line or line.isspace():
+    if offset == -1:
         return block_opening_line_idx
 
     # If the next non-empty, non-whitespace line has the same or lesser indent,
     # this line does not open a block, so return the index of the line itself.
-    for line in file_lines[block_opening_line_idx + 1:]:
-        if not line or line.isspace():
-            continue
-        next_offset = len(line) - len(line.lstrip())
-        if next_offset <= offset:
-            return block_opening_line_idx
-        break
-    else:
+    next_idx = block_opening_line_idx + 1
+    while next_idx < len(line_indents) and line_indents[next_idx] == -1:
+        next_idx += 1
+    if next_idx == len(line_indents) or line_indents[next_idx] <= offset:
         return block_opening_line_idx
     
-    # Get index of first line with equal or lesser indent (goes one line too far)
-    next_idx = block_opening_line_idx + 1
-    while True:
-        if next_idx == len(file_lines):
-            break
-
-        line = file_lines[next_idx]
-        
-        # Skip empty lines, which may have no indent
-        if not line or line.isspace():
-            next_idx += 1
-            continue
-
-        next_offset = len(line) - len(line.lstrip())
-        
-        if next_offset <= offset:
+    # Get index of first line with equal or lesser indent (goes one line too far).
+    # Empty lines (indent -1) may have no indent, so they are skipped.
+    while next_idx < len(line_indents):
+        next_offset = line_indents[next_idx]
+        if next_offset != -1 and next_offset <= offset:
             break
-
         next_idx += 1
 
     # Roll back one    
     next_idx -= 1
     
     # Roll back while the last lines of the block have no content
-    while not file_lines[next_idx] or file_lines[next_idx].isspace():
+    while line_indents[next_idx] == -1:
         next_idx -= 1
     
     return next_idx
@@ -160,15 +240,43 @@ def get_end_of_block_idx(
 def get_full_block(
         block_opening_line_idx: int,
         file_lines: List[str],
+        line_indents: List[int] | None = None,
     ) -> str:
     """
     Given the 0-indexed line index of the opening line of a block (e.g. if statement, for loop,
     etc.), return a string with the all the lines (including the given one) in the block.
     """
-    end_idx = get_end_of_block_idx(block_opening_line_idx, file_lines)
-    block_lines = file_lines[block_opening_line_idx: end_idx + 1]
+    block_lines, _ = get_full_block_and_end(block_opening_line_idx, file_lines, line_indents)
     return '\n'.join(block_lines)
 
+def get_full_block_and_end(
+        block_opening_line_idx: int,
+        file_lines: List[str],
+        line_indents: List[int] | None = None,
+    ) -> tuple[List[str], int]:
+    """
+    Like `get_full_block()`, but return the lines in the block as a list, along with
+    the 0-indexed line index of the last line in the block.
+    """
+    end_idx = get_end_of_block_idx(block_opening_line_idx, file_lines, line_indents)
+    return file_lines[block_opening_line_idx: end_idx + 1], end_idx
+
+def block_starts_with_docstr(
+        block_opening_line_idx: int,
+        block_end_idx: int,
+        file_lines: List[str],
+        line_indents: List[int],
+    ) -> bool:
+    """
+    Return whether the first non-blank line after the opening line of a block starts
+    with triple quotes. `line_indents` should be the result of `get_line_indents(file_lines)`.
+    """
+    idx = block_opening_line_idx + 1
+    while idx <= block_end_idx and line_indents[idx] == -1:
+        idx += 1
+    # `startswith()` can check from the end of the indent without slicing the line
+    return idx <= block_end_idx and file_lines[idx].startswith('\"\"\"', line_indents[idx])
+
 
 '''
 Recursive functions that change a particular value. These do not
@@ -186,93 +294,102 @@ def py_val_to_ts(py_val: str) -> str:
 
 def py_type_to_ts(py_type: str | None) -> str:
     """Convert a Python type annotation to a TypeScript type annotation."""
-    def helper(s: str | None) -> str:
-        if s is None:
-            return 'any'
-        if s == '':
-            return ''
-        if s == 'str':
-            return 'string'
-        if s in ('int', 'float'):
-            return 'number'
-        if s == 'bool':
-            return 'boolean'
-        if s == 'True':
-            return 'true'
-        if s == 'False':
-            return 'false'
-        if s == 'None':
-            return 'void'
-
-        if s.startswith('Union['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            types = list(map(helper, args))
-            unique_types = []
-            for t in types:
-                if t not in unique_types:
-                    unique_types.append(t)
-                
-            return ' | '.join(unique_types)
-        if s.startswith('Optional['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            return helper(s[b1+1: b2]) + ' | null'
-        if s.startswith('List['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            assert len(args) == 1, f'Expected 1 type in List, got {len(args)}'
-            t, = args
-            return f'Array<{helper(t)}>'
-        if s.startswith('Mapping[') or s.startswith('Dict['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            assert len(args) == 2, f'Expected 2 types in Mapping, got {len(args)}'
-            t1, t2 = args
-            return f'Map<{helper(t1)}, {helper(t2)}>'
-        if s.startswith('Iterator['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            assert len(args) == 1, f'Expected 1 type in Iterator, got {len(args)}'
-            t, = args
-            return f'Iterator<{helper(s[b1+1: b2])}>'
-        if s.startswith('Iterable['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            assert len(args) == 1, f'Expected 1 type in Iterable, got {len(args)}'
-            t, = args
-            return f'Iterable<{helper(t)}>'
-        if s.lower().startswith('tuple['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            return f'[{", ".join(map(helper, args))}]'
-        if s.startswith('Callable['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            assert len(args) == 2, f'Expected 2 types in Callable, got {len(args)}'
-            params, ret_type = args
-            params = split_not_in_brackets(params.strip('[]'), ',', strip_elements=True)
-            return f'({", ".join(map(helper, params))}) => {helper(ret_type)}'
-        if s.startswith('Mainline['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            assert len(args) == 1, f'Expected 1 type in Mainline, got {len(args)}'
-            t, = args
-            return f'Mainline<{helper(t)}>'
-        if s.startswith('BaseVisitor['):
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            assert len(args) == 1, f'Expected 1 type in BaseVisitor, got {len(args)}'
-            t, = args
-            return f'BaseVisitor<{helper(t)}>'
-        if '[' in s:
-            b1, b2 = get_first_brackets(s, assert_closes_at_end=True)
-            args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
-            return f'{s[:b1]}<{", ".join(map(helper, args))}>'
-        
+    return _py_type_to_ts(py_type)
+
+# Simple types that have a direct TypeScript equivalent
+_SCALAR_TYPES = {
+    '': '',
+    'str': 'string',
+    'int': 'number',
+    'float': 'number',
+    'bool': 'boolean',
+    'True': 'true',
+    'False': 'false',
+    'None': 'void',
+}
+
+def _union_to_ts(args: List[str]) -> str:
+    unique_types = []
+    for t in map(_py_type_to_ts, args):
+        if t not in unique_types:
+            unique_types.append(t)
+    return ' | '.join(unique_types)
+
+def _optional_to_ts(args: List[str]) -> str:
+    assert len(args) == 1, f'Expected 1 type in Optional, got {len(args)}'
+    t, = args
+    return _py_type_to_ts(t) + ' | null'
+
+def _list_to_ts(args: List[str]) -> str:
+    assert len(args) == 1, f'Expected 1 type in List, got {len(args)}'
+    t, = args
+    return f'Array<{_py_type_to_ts(t)}>'
+
+def _mapping_to_ts(args: List[str]) -> str:
+    assert len(args) == 2, f'Expected 2 types in Mapping, got {len(args)}'
+    t1, t2 = args
+    return f'Map<{_py_type_to_ts(t1)}, {_py_type_to_ts(t2)}>'
+
+def _tuple_to_ts(args: List[str]) -> str:
+    return f'[{", ".join(map(_py_type_to_ts, args))}]'
+
+def _callable_to_ts(args: List[str]) -> str:
+    assert len(args) == 2, f'Expected 2 types in Callable, got {len(args)}'
+    params, ret_type = args
+    param_types = split_not_in_brackets(params.strip('[]'), ',', strip_elements=True)
+    return f'({", ".join(map(_py_type_to_ts, param_types))}) => {_py_type_to_ts(ret_type)}'
+
+def _single_generic_to_ts(name: str) -> Callable[[List[str]], str]:
+    """Return a handler for a generic type `name` that takes exactly 1 type argument."""
+    def handler(args: List[str]) -> str:
+        assert len(args) == 1, f'Expected 1 type in {name}, got {len(args)}'
+        t, = args
+        return f'{name}<{_py_type_to_ts(t)}>'
+    return handler
+
+# Generic types that need special handling, keyed by the name before the brackets.
+# Each handler takes the (stripped) type arguments inside the brackets.
+_GENERIC_HANDLERS: dict[str, Callable[[List[str]], str]] = {
+    'Union': _union_to_ts,
+    'Optional': _optional_to_ts,
+    'List': _list_to_ts,
+    'Mapping': _mapping_to_ts,
+    'Dict': _mapping_to_ts,
+    'Iterator': _single_generic_to_ts('Iterator'),
+    'Iterable': _single_generic_to_ts('Iterable'),
+    'Tuple': _tuple_to_ts,
+    'tuple': _tuple_to_ts,
+    'Callable': _callable_to_ts,
+    'Mainline': _single_generic_to_ts('Mainline'),
+    'BaseVisitor': _single_generic_to_ts('BaseVisitor'),
+}
+
+@functools.lru_cache(maxsize=4096)
+def _py_type_to_ts(s: str | None) -> str:
+    """
+    Recursive, cached implementation of `py_type_to_ts()`. The same type annotations
+    show up over and over in a file, so each one only needs to be converted once.
+    """
+    if s is None:
+        return 'any'
+
+    b1 = s.find('[')
+    if b1 == -1:
         # Assume other types are also defined in TS
-        return s
-    
-    return helper(py_type)
+        return _SCALAR_TYPES.get(s, s)
+
+    # We already know where the first bracket is, so only look for its match
+    b2 = get_matching_bracket_idx(s, b1)
+    if b2 != len(s) - 1:
+        raise ValueError(f'Closing bracket not at the end of the string: {s}')
+    args = split_not_in_brackets(s[b1+1: b2], ',', strip_elements=True)
+    name = s[:b1]
+    handler = _GENERIC_HANDLERS.get(name)
+    if handler is not None:
+        return handler(args)
+
+    # Assume other generic types are also defined in TS
+    return f'{name}<{", ".join(map(_py_type_to_ts, args))}>'
 
 def py_keyword_to_ts(py_keyword: str) -> str:
     if py_keyword == 'except':
@@ -300,8 +417,37 @@ def py_method_name_to_ts(py_method_name: str) -> str:
 
 
 '''
-Functions that operate on the entire string of the code at once.
+Functions that operate on the entire code at once. Each one has a `*_lines` version
+that takes and returns a list of lines, which `py_to_ts()` chains together so the
+code doesn't have to be split and re-joined between every step, and a version that
+takes and returns a string for converting code directly.
 '''
+# All of the substitutions in `py_misc_to_ts()` fused into one pattern so the
+# string only has to be scanned once. Each alternative is a named group.
+_MISC_PAT = re.compile(
+    r'(?P<self>\bself\b)'                     # self -> this
+    r'|(?<=[a-z0-9])_(?P<snake>[a-z0-9])'     # snake_case -> camelCase
+    r'|(?P<none>\bNone\b)'                    # None -> null
+    r'|(?P<true>\bTrue\b)'                    # True -> true
+    r'|(?P<false>\bFalse\b)'                  # False -> false
+    r'|(?P<eq>(?<=[\w ])==(?=[\w ]))'          # == -> ===
+    r'|(?P<ne>(?<=[\w ])!=(?=[\w ]))'          # != -> !==
+)
+_MISC_REPLACEMENTS = {
+    'self': 'this',
+    'none': 'null',
+    'true': 'true',
+    'false': 'false',
+    'eq': '===',
+    'ne': '!==',
+}
+
+def _misc_replacement(match: re.Match[str]) -> str:
+    if match.lastgroup == 'snake':
+        return match.group('snake').upper()
+    assert match.lastgroup is not None
+    return _MISC_REPLACEMENTS[match.lastgroup]
+
 def py_misc_to_ts(py_str: str) -> str:
     """
     Convert various Python code to TypeScript syntax:
@@ -316,100 +462,88 @@ def py_misc_to_ts(py_str: str) -> str:
     These are all simple regex substitutions intended as a safe first pass 
     on an entire Python file before making more complex transformations.
     """
-    # self -> this
-    py_str = re.sub(r'(?<=\b)self(?=\b)', 'this', py_str)
-
-    # snake_case -> camelCase
-    py_str = re.sub(r'(?<=[a-z0-9])_([a-z0-9])', lambda m: m.group(1).upper(), py_str)
-
-    # None -> null
-    py_str = re.sub(r'(?<=\b)None(?=\b)', 'null', py_str)
-    
-    # True -> true
-    py_str = re.sub(r'(?<=\b)True(?=\b)', 'true', py_str)
-
-    # False -> false
-    py_str = re.sub(r'(?<=\b)False(?=\b)', 'false', py_str)
+    return _MISC_PAT.sub(_misc_replacement, py_str)
 
-    # == -> ===
-    py_str = re.sub(r'(?:(?<=\b)|(?<= ))==(?=\b| )', '===', py_str)
-
-    # != -> !==
-    py_str = re.sub(r'(?:(?<=\b)|(?<= ))!=(?=\b| )', '!==', py_str)
+def py_misc_to_ts_lines(py_str_lines: List[str]) -> List[str]:
+    """
+    Like `py_misc_to_ts()`, but operates on a list of lines. None of the substitutions
+    can span multiple lines, so this gives the same result.
+    """
+    return [_MISC_PAT.sub(_misc_replacement, line) for line in py_str_lines]
 
-    return py_str
+_IF_PAT = re.compile(r'^( *)(?:(?:(if|elif|while|for|except) (.+?))|(?:(else|try|finally))):')
 
 def py_blocks_to_ts(py_str: str, *, indent_size: int = 4) -> str:
     """
     Convert Python `if/elif/else/while/for/try/except/finally` blocks to TypeScript syntax.
     """
-    if_pat = re.compile(r'^( *)(?:(?:(if|elif|while|for|except) (.+?))|(?:(else|try|finally))):')
-    
-    py_str_lines = py_str.splitlines()
+    return '\n'.join(py_blocks_to_ts_lines(py_str.splitlines(), indent_size=indent_size))
 
-    # The length of the lines will change as we update block formatting with braces {},
-    # so we need to update the length manually every time we change it.
-    dynamic_len_py_str_lines = len(py_str_lines)
+def py_blocks_to_ts_lines(py_str_lines: List[str], *, indent_size: int = 4) -> List[str]:
+    """Like `py_blocks_to_ts()`, but operates on a list of lines."""
+    line_indents = get_line_indents(py_str_lines)
+
+    # Rather than splicing each converted block back into `py_str_lines` (which shifts
+    # the whole tail of the list every time), we walk the input once and append to
+    # `out_lines`. Nested blocks still need their inner lines converted, so instead of
+    # emitting a block's closing brace right away we push it onto `pending_closers`
+    # along with the index of the block's last line, and emit it once we pass that line.
+    out_lines = []
+    pending_closers: List[tuple[int, str]] = []
 
     # We are checking each line here for a match of the pattern, which matches when
     # the line opens one of the supported blocks. Then we get the full block, wrap it
     # in braces, convert the keyword to TS, and wrap the condition in parentheses if
     # one exists (only for `if/elif/while/for/except`).
-    i = 0
-    while i < dynamic_len_py_str_lines:
-        line = py_str_lines[i]
-        match = if_pat.match(line)
+    for i, line in enumerate(py_str_lines):
+        while pending_closers and pending_closers[-1][0] < i:
+            out_lines.append(pending_closers.pop()[1])
+
+        match = _IF_PAT.match(line)
         if not match:
-            i += 1
+            out_lines.append(line)
             continue
         
         # Here we know we have the opening of an if/elif/else/while/try/except/finally block.
         #   - `keyword` can hold `if/elif/while/for/except`
         #   - `keyword_no_condition` can hold `else/try/finally`
         spaces, keyword, condition, keyword_no_condition = match.groups()
+        closer = spaces + '}'
         
-        start_idx = i
-        end_idx = get_end_of_block_idx(start_idx, py_str_lines)
+        end_idx = get_end_of_block_idx(i, py_str_lines, line_indents)
 
         # If we just closed another block and this one is the next block in the chain,
         # we can remove the previous line with its closing brace and add one before
         # the keyword in this block.
         leading_brace = ''
-        if py_str_lines[start_idx-1] == f'{spaces}}}':
+        if out_lines and out_lines[-1] == closer:
             if keyword in ('elif', 'except') or keyword_no_condition in ('else', 'finally'):
-                del py_str_lines[start_idx-1]
-                dynamic_len_py_str_lines = len(py_str_lines)
-                start_idx -= 1
-                end_idx -= 1
+                out_lines.pop()
                 leading_brace = '} '
         
         # In the special case for `for` blocks, let's change `condition`:
         #  - `x in y` -> `x of y`
         if keyword == 'for':
             parts = split_not_in_brackets(condition, ' in ')
-            assert len(parts) == 2, f'Expected 2 parts in for loop condition, got {len(parts)}. {condition=}'
-            var, itr = parts
+            assert len(parts) >= 2, f'Expected at least 2 parts in for loop condition, got {len(parts)}. {condition=}'
+            # The loop variable can't contain ` in `, but the iterable can
+            # (ex. `sorted(x for x in y)`), so keep everything after the first one.
+            var, *itr_parts = parts
+            itr = ' in '.join(itr_parts)
             condition = f'const {var} of {itr}'
 
         condition = f' ({condition})' if condition else ''
         keyword = py_keyword_to_ts(keyword if keyword else keyword_no_condition)
 
-        # Build the TypeScript block
-        if_block = py_str_lines[start_idx: end_idx + 1]
-        ts_if_block = [
-            f'{spaces}{leading_brace}{keyword}{condition} {{',
-            *if_block[1:],
-            f'{spaces}}}'
-        ]
-
-        # Python trick - you can replace a slice with another list of arbitrary size
-        # Ex: [0, 1, 2][1:1] = [3, 4, 5] -> [0, 3, 4, 5, 1, 2]
-        py_str_lines[start_idx: end_idx + 1] = ts_if_block
-        dynamic_len_py_str_lines = len(py_str_lines)
+        # Emit the TypeScript block opener now and the closer after the block's last line.
+        # The lines inside the block are converted on the following iterations.
+        out_lines.append(f'{spaces}{leading_brace}{keyword}{condition} {{')
+        pending_closers.append((end_idx, closer))
 
-        i += 1
+    while pending_closers:
+        out_lines.append(pending_closers.pop()[1])
     
-    return '\n'.join(py_str_lines)
+    return out_lines
 
 def py_docstr_to_ts(py_docstr: str, *, num_spaces: int = 0) -> str:
     """
@@ -418,24 +552,19 @@ def py_docstr_to_ts(py_docstr: str, *, num_spaces: int = 0) -> str:
     `py_docstr` should include the leading and trailing triple quote, and
     optionally the leading whitespace before the first triple quote.
     """
+    return '\n'.join(py_docstr_to_ts_lines(py_docstr, num_spaces=num_spaces))
+
+def py_docstr_to_ts_lines(py_docstr: str, *, num_spaces: int = 0) -> List[str]:
+    """Like `py_docstr_to_ts()`, but returns the lines of the JSDoc comment as a list."""
     if not py_docstr:
-        return ''
+        return []
 
     # First we have to de-indent the whole docstring. Below we remove the triple
-    # quotes, get the minimum number of spaces at the start of each non-blank line,
-    # and remove that many spaces from the start of each line.
-    py_docstr = py_docstr.replace('\"\"\"', '')
-    lines = py_docstr.splitlines()
-    non_blank_lines = [line for line in lines if line and not line.isspace()]
-    line_indent_sizes = [len(line) - len(line.lstrip()) for line in non_blank_lines]
-    min_indent = min(line_indent_sizes) if line_indent_sizes else 0
-    lines = [line[min_indent:] for line in lines]
-
-    # Remove leading and trailing whitespace lines
-    while not lines[0] or lines[0].isspace():
-        del lines[0]
-    while not lines[-1] or lines[-1].isspace():
-        del lines[-1]
+    # quotes and let `dedent()` remove the common leading whitespace from every
+    # line (it also empties whitespace-only lines), then drop the leading and
+    # trailing blank lines.
+    py_docstr = dedent(py_docstr.replace('\"\"\"', ''))
+    lines = py_docstr.strip('\n').splitlines()
 
     # Build the JSDoc comment
     indent = ' ' * num_spaces
@@ -449,30 +578,47 @@ def py_docstr_to_ts(py_docstr: str, *, num_spaces: int = 0) -> str:
         last
     ]
     
-    return '\n'.join(ts_block)
+    return ts_block
+
+# https://regex101.com/r/hhf0aE/5
+_METHOD_PAT = re.compile(r'^( +)def ([a-zA-Z0-9_]+?)\((?:self|cls)(?:, |: (?:[^\s,]*(?:, )?))?(.*)\)(?: -> (.*))?:(.*)')
+
+# https://regex101.com/r/asYLn1/6
+# This should be used after `get_full_block()` as it uses newlines and 
+# asserts position at start of line. Replace this pat with the first
+# capture group ('\1') to remove the docstring.
+# Each character of the docstring body can only be matched one way, so a
+# docstring with no closing quotes fails quickly instead of backtracking
+# exponentially over every whitespace character.
+_DOCSTR_METHOD_PAT = re.compile(r'^( *def.*:[^\n]*)(\n\s+\"\"\"(?:[^\"]|\"(?!\"\"))*\"\"\"(?:(?:\n *(?!\S))+(?=\n))?)?')
 
 def py_methods_to_ts(py_str: str) -> str:
     """Convert all Python functions/methods found in `py_str` to TypeScript syntax."""
-    # https://regex101.com/r/hhf0aE/5
-    method_pat = re.compile(r'^( +)def ([a-zA-Z0-9_]+?)\((?:self|cls)(?:, |: (?:[^\s,]*(?:, )?))?(.*)\)(?: -> (.*))?:(.*)')
+    return '\n'.join(py_methods_to_ts_lines(py_str.splitlines()))
 
-    # https://regex101.com/r/asYLn1/6
-    # This should be used after `get_full_block()` as it uses newlines and 
-    # asserts position at start of line. Replace this pat with the first
-    # capture group ('\1') to remove the docstring.
-    docstr_pat = re.compile(r'^( *def.*:[^\n]*)(\n\s+\"\"\"(?:\s|[^\"]|\"(?!\"\")|\"\"(?!\"))*\"\"\"(?:(?:\n(?: *|)(?!\S))+(?=\n))?)?')
+def py_methods_to_ts_lines(py_str_lines: List[str]) -> List[str]:
+    """Like `py_methods_to_ts()`, but operates on a list of lines."""
+    line_indents = get_line_indents(py_str_lines)
 
-    py_str_lines = py_str.splitlines()
-    dynamic_len_py_str_lines = len(py_str_lines)
+    # See `py_blocks_to_ts_lines()` for how `out_lines` and `pending_closers` are used.
+    out_lines = []
+    pending_closers: List[tuple[int, str]] = []
 
     # We are checking each line here for a match of the pattern, which matches when
     # the line opens a method block. Then we get the full block, wrap it
     # in braces and convert the signature to TS.
     i = 0
-    while i < dynamic_len_py_str_lines:
+    while i < len(py_str_lines):
+        while pending_closers and pending_closers[-1][0] < i:
+            out_lines.append(pending_closers.pop()[1])
+
         line = py_str_lines[i]
-        match = method_pat.match(line)
+
+        # Most lines don't contain `def ` at all, and checking that is much
+        # cheaper than a failed regex match
+        match = _METHOD_PAT.match(line) if 'def ' in line else None
         if not match:
+            out_lines.append(line)
             i += 1
             continue
         
@@ -483,21 +629,22 @@ def py_methods_to_ts(py_str: str) -> str:
         return_type = f': {return_type}' if return_type is not None else ''
 
         start_block_idx = i
-        end_block_idx = get_end_of_block_idx(start_block_idx, py_str_lines)
-        full_block = get_full_block(start_block_idx, py_str_lines)
-
-        # Try to get the docstring if it exists.
-        docstr_match = docstr_pat.match(full_block)
-        docstr = ''
-        if docstr_match and docstr_match.group(2) is not None:
-            # Build the TypeScript docstr
-            docstr = docstr_match.group(2).strip()
-            docstr = py_docstr_to_ts(docstr, num_spaces=len(spaces))
-
-            # Replace the signature + docstring with just the signature
-            full_block = docstr_pat.sub(r'\1', full_block)
-        docstr_lines = docstr.splitlines()
-        full_block_lines = full_block.splitlines()
+        block_lines, end_block_idx = get_full_block_and_end(start_block_idx, py_str_lines, line_indents)
+        body_lines = block_lines[1:]
+
+        # Try to get the docstring if it exists. The pattern only needs to run
+        # if the first non-blank line of the body starts with triple quotes.
+        docstr_lines = []
+        if block_starts_with_docstr(start_block_idx, end_block_idx, py_str_lines, line_indents):
+            full_block = '\n'.join(block_lines)
+            docstr_match = _DOCSTR_METHOD_PAT.match(full_block)
+            if docstr_match and docstr_match.group(2) is not None:
+                # Build the TypeScript docstr
+                docstr = docstr_match.group(2).strip()
+                docstr_lines = py_docstr_to_ts_lines(docstr, num_spaces=len(spaces))
+
+                # Replace the signature + docstring with just the signature
+                body_lines = _DOCSTR_METHOD_PAT.sub(r'\1', full_block).splitlines()[1:]
         
         # Extract positional args and kwargs from parameter list
         args: List[tuple[str, str | None, str | None]] = []    
@@ -545,45 +692,59 @@ def py_methods_to_ts(py_str: str) -> str:
 
         args_str = ', '.join(arg_list_builder)
 
-        # Build the TypeScript method signature and body
-        ts_method = [
-            *docstr_lines,
-            f'{spaces}{method_name}({args_str}){return_type} {{{after_colon}',
-            *full_block_lines[1:],
-            f'{spaces}}}'
-        ]
+        # Emit the TypeScript docstring and method signature now and the closer after
+        # the method's last line. The body is converted on the following iterations.
+        out_lines.extend(docstr_lines)
+        out_lines.append(f'{spaces}{method_name}({args_str}){return_type} {{{after_colon}')
+        pending_closers.append((end_block_idx, spaces + '}'))
 
-        # Replace the Python method with the TypeScript method
-        py_str_lines[start_block_idx: end_block_idx + 1] = ts_method
-        dynamic_len_py_str_lines = len(py_str_lines)
+        # Jump below the method signature and the docstring (if one was removed)
+        i = end_block_idx + 1 - len(body_lines)
 
-        # Jump below the docstring and the method signature
-        i += len(docstr_lines) + 1
+    while pending_closers:
+        out_lines.append(pending_closers.pop()[1])
 
-    return '\n'.join(py_str_lines)
+    return out_lines
+
+# https://regex101.com/r/7Hw5wS/5
+_CLASS_PAT = re.compile(r'^( *)class ([a-zA-Z0-9_]*?)(?:\((.*?)\))?:(.*)')
+
+# https://regex101.com/r/asYLn1/6
+# This should be used after `get_full_block()` as it uses newlines and 
+# asserts position at start of line. Replace this pat with the first
+# capture group ('\1') to remove the docstring.
+# Each character of the docstring body can only be matched one way, so a
+# docstring with no closing quotes fails quickly instead of backtracking
+# exponentially over every whitespace character.
+_DOCSTR_CLASS_PAT = re.compile(r'^( *class.*:[^\n]*)(\n\s+\"\"\"(?:[^\"]|\"(?!\"\"))*\"\"\"(?:(?:\n *(?!\S))+(?=\n))?)?')
 
 def py_classes_to_ts(py_str: str) -> str:
     """Convert all Python classes found in `py_str` to TypeScript syntax."""
-    # https://regex101.com/r/7Hw5wS/5
-    class_pat = re.compile(r'^( *)class ([a-zA-Z0-9_]*?)(?:\((.*?)\))?:(.*)')
-    
-    # https://regex101.com/r/asYLn1/6
-    # This should be used after `get_full_block()` as it uses newlines and 
-    # asserts position at start of line. Replace this pat with the first
-    # capture group ('\1') to remove the docstring.
-    docstr_pat = re.compile(r'^( *class.*:[^\n]*)(\n\s+\"\"\"(?:\s|[^\"]|\"(?!\"\")|\"\"(?!\"))*\"\"\"(?:(?:\n(?: *|)(?!\S))+(?=\n))?)?')
+    return '\n'.join(py_classes_to_ts_lines(py_str.splitlines()))
 
-    py_str_lines = py_str.splitlines()
-    dynamic_len_py_str_lines = len(py_str_lines)
+def py_classes_to_ts_lines(py_str_lines: List[str]) -> List[str]:
+    """Like `py_classes_to_ts()`, but operates on a list of lines."""
+    line_indents = get_line_indents(py_str_lines)
+
+    # See `py_blocks_to_ts_lines()` for how `out_lines` and `pending_closers` are used.
+    out_lines = []
+    pending_closers: List[tuple[int, str]] = []
 
     # We are checking each line here for a match of the pattern, which matches
     # when the line opens a class block. Then we get the full block, wrap it
     # in braces and convert the signature to TS.
     i = 0
-    while i < dynamic_len_py_str_lines:
+    while i < len(py_str_lines):
+        while pending_closers and pending_closers[-1][0] < i:
+            out_lines.append(pending_closers.pop()[1])
+
         line = py_str_lines[i]
-        match = class_pat.match(line)
+
+        # Most lines don't contain `class ` at all, and checking that is much
+        # cheaper than a failed regex match
+        match = _CLASS_PAT.match(line) if 'class ' in line else None
         if not match:
+            out_lines.append(line)
             i += 1
             continue
 
@@ -592,38 +753,41 @@ def py_classes_to_ts(py_str: str) -> str:
         base_classes = f' extends {base_classes}' if base_classes else ''
 
         start_block_idx = i
-        end_block_idx = get_end_of_block_idx(start_block_idx, py_str_lines)
-        full_block = get_full_block(start_block_idx, py_str_lines)
-        
-        # Try to get the docstring if it exists.
-        docstr_match = docstr_pat.match(full_block)
-        docstr = ''
-        if docstr_match and docstr_match.group(2) is not None:
-            # Build the TypeScript docstr
-            docstr = docstr_match.group(2).strip()
-            docstr = py_docstr_to_ts(docstr, num_spaces=len(spaces))
-
-            # Replace the signature + docstring with just the signature
-            full_block = docstr_pat.sub(r'\1', full_block)
-        docstr_lines = docstr.splitlines()
-        full_block_lines = full_block.splitlines()
-
-        # Build the TypeScript class signature and body
-        ts_class = [
-            *docstr_lines,
-            f'{spaces}class {class_name}{base_classes} {{{after_colon}',
-            *full_block_lines[1:],
-            f'{spaces}}}'
-        ]
-
-        # Replace the Python class with the TypeScript class
-        py_str_lines[start_block_idx: end_block_idx + 1] = ts_class
-        dynamic_len_py_str_lines = len(py_str_lines)
-
-        # Jump below the docstring and the class signature
-        i += len(docstr_lines) + 1
-
-    return '\n'.join(py_str_lines)
+        block_lines, end_block_idx = get_full_block_and_end(start_block_idx, py_str_lines, line_indents)
+        body_lines = block_lines[1:]
+
+        # Try to get the docstring if it exists. The pattern only needs to run
+        # if the first non-blank line of the body starts with triple quotes.
+        docstr_lines = []
+        if block_starts_with_docstr(start_block_idx, end_block_idx, py_str_lines, line_indents):
+            full_block = '\n'.join(block_lines)
+            docstr_match = _DOCSTR_CLASS_PAT.match(full_block)
+            if docstr_match and docstr_match.group(2) is not None:
+                # Build the TypeScript docstr
+                docstr = docstr_match.group(2).strip()
+                docstr_lines = py_docstr_to_ts_lines(docstr, num_spaces=len(spaces))
+
+                # Replace the signature + docstring with just the signature
+                body_lines = _DOCSTR_CLASS_PAT.sub(r'\1', full_block).splitlines()[1:]
+
+        # Emit the TypeScript docstring and class signature now and the closer after
+        # the class's last line. The body is converted on the following iterations.
+        out_lines.extend(docstr_lines)
+        out_lines.append(f'{spaces}class {class_name}{base_classes} {{{after_colon}')
+        pending_closers.append((end_block_idx, spaces + '}'))
+
+        # Jump below the class signature and the docstring (if one was removed)
+        i = end_block_idx + 1 - len(body_lines)
+
+    while pending_closers:
+        out_lines.append(pending_closers.pop()[1])
+
+    return out_lines
+
+@functools.lru_cache(maxsize=None)
+def _get_dedent_pat(old_indent_size: int) -> re.Pattern[str]:
+    """Return a pattern matching the indent at the start of every line in a string."""
+    return re.compile(fr'(?m)^((?: {{{old_indent_size}}})+)')
 
 def py_dedent(
         py_str: str,
@@ -636,40 +800,66 @@ def py_dedent(
     by replacing occurrences of `' ' * (old_indent_size * max_iters)` with `' ' * (new_indent_size * max_iters)`,
     then `' ' * (old_indent_size * (max_iters - 1))` with `' ' * (new_indent_size * (max_iters - 1))`, etc.
     """
-    py_str_lines = py_str.splitlines()
+    # One substitution over the whole string handles every line
+    pat = _get_dedent_pat(old_indent_size)
+    return pat.sub(lambda m: ' ' * new_indent_size * (len(m.group(1)) // old_indent_size), py_str)
 
-    pat = re.compile(fr'^((?: {{{old_indent_size}}})+)')
-    for i, line in enumerate(py_str_lines):
-        match = pat.match(line)
-        if match:
-            indent = match.group(1)
-            assert len(indent) % old_indent_size == 0
-            new_indent = ' ' * new_indent_size * (len(indent) // old_indent_size)
-            py_str_lines[i] = pat.sub(new_indent, line)
-    
-    return '\n'.join(py_str_lines)
+def py_dedent_lines(
+        py_str_lines: List[str],
+        *,
+        old_indent_size: int = 4,
+        new_indent_size: int = 2,
+    ) -> List[str]:
+    """Like `py_dedent()`, but operates on a list of lines."""
+    pat = _get_dedent_pat(old_indent_size)
+    def new_indent(m: re.Match[str]) -> str:
+        return ' ' * new_indent_size * (len(m.group(1)) // old_indent_size)
+    return [pat.sub(new_indent, line) for line in py_str_lines]
+
+_COMMENT_PAT = re.compile(r'(?:(?<=[^#])|^)#')
 
 def py_comments_to_ts(py_str: str) -> str:
     """
     Convert inline Python comments to inline TypeScript comments. This is a simple regex substitution
     that replaces instances of '# ' with '//'.
     """
-    py_str = re.sub(r'(?:(?<=[^#])|^)#', '//', py_str)
-    return py_str
+    # Only the first `#` in a run of them is replaced. If there are no runs, that's
+    # every `#`, and a plain `str.replace()` is much faster than the regex.
+    if '##' not in py_str:
+        return py_str.replace('#', '//')
+    return _COMMENT_PAT.sub('//', py_str)
+
+def py_comments_to_ts_lines(py_str_lines: List[str]) -> List[str]:
+    """Like `py_comments_to_ts()`, but operates on a list of lines."""
+    return [py_comments_to_ts(line) if '#' in line else line for line in py_str_lines]
 
 def py_to_ts(py_str: str) -> str:
     """Convert Python code to TypeScript. Note that this is far from a perfect implementation!"""
-    py_str = py_classes_to_ts(py_str)
-    py_str = py_methods_to_ts(py_str)
-    py_str = py_misc_to_ts(py_str)
-    py_str = py_blocks_to_ts(py_str)
-    py_str = py_dedent(py_str, old_indent_size=4, new_indent_size=2)
-    py_str = py_comments_to_ts(py_str)
+    py_str_lines = py_str.splitlines()
+    py_str_lines = py_classes_to_ts_lines(py_str_lines)
+    py_str_lines = py_methods_to_ts_lines(py_str_lines)
+    py_str_lines = py_misc_to_ts_lines(py_str_lines)
+    py_str_lines = py_blocks_to_ts_lines(py_str_lines)
+    py_str_lines = py_dedent_lines(py_str_lines, old_indent_size=4, new_indent_size=2)
+    py_str_lines = py_comments_to_ts_lines(py_str_lines)
+
+    return '\n'.join(py_str_lines)
+
+
+def main() -> None:
+    # Convert from stdin to stdout instead of using the clipboard, ex.
+    # `python transpilation_helper.py --stdin < foo.py > foo.ts`
+    if '--stdin' in sys.argv:
+        sys.stdout.write(py_to_ts(sys.stdin.read()) + '\n')
+        return
 
-    return py_str
+    if pc is None:
+        print('pyperclip is required to use the clipboard (`pip install pyperclip`), or use `--stdin`.')
+        return
 
+    if '__pypy__' in sys.builtin_module_names:
+        print('Running on PyPy, JIT enabled.')
 
-def main():
     while True:
         input('Press Enter to paste Python code and convert it to TypeScript...')
         s = pc.paste()